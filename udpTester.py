@@ -1,12 +1,13 @@
 import argparse
+import array
 import ctypes
-import ipaddress
+import errno
 import math
+import os
 import random
 import signal
 import socket
 import selectors
-import statistics
 import struct
 import sys
 import textwrap
@@ -18,41 +19,118 @@ import time
 #     int packetIndex;
 #     double timestamp;
 # };
+# The timestamp is the transmitter's wall clock time in seconds since the epoch, as returned by
+# time.time(). The receiver compares it with its own wall clock, so a per-host clock such as
+# time.monotonic() can't be used here.
 
 UDPTESTER_HDRFORMAT = (
     "<2id"  # Little endian and consists of two ints and a double. See C struct above.
 )
-UDPTESTER_HDRSIZE = struct.calcsize(UDPTESTER_HDRFORMAT)
+# Precompiled header format, so the hot loops don't re-parse the format string per packet.
+_HDR_STRUCT = struct.Struct(UDPTESTER_HDRFORMAT)
+UDPTESTER_HDRSIZE = _HDR_STRUCT.size
 UDPTESTER_MIN_MSGSIZE = UDPTESTER_HDRSIZE
 UDPTESTER_MIN_PKTSIZE = UDPTESTER_MIN_MSGSIZE
+UDPTESTER_RECV_BATCHSIZE = 128  # Maximum number of packets received per recvmmsg() call
+UDPTESTER_RECV_BATCHBYTES = (
+    1024 * 1024
+)  # Maximum size of the buffer a batch is received in
+UDPTESTER_SEND_BATCHSIZE = 64  # Maximum number of packets sent per sendmmsg() call
+
+# The C equivalents of the Linux structures used by recvmmsg() and sendmmsg() are
+# struct iovec { void *iov_base; size_t iov_len; };
+# struct msghdr { void *msg_name; socklen_t msg_namelen; struct iovec *msg_iov; size_t msg_iovlen;
+#                 void *msg_control; size_t msg_controllen; int msg_flags; };
+# struct mmsghdr { struct msghdr msg_hdr; unsigned int msg_len; };
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
 
 
-def ipAddressSanityCheck(address):
-    try:
-        ipaddress.ip_address(address)
-    except ValueError:
-        return False
-    return True
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
 
 
-def ipAddressMulticastCheck(address):
-    addressSplit = address.split(".")
-    numbers = [int(element) for element in addressSplit if element.isdigit()]
-    if numbers[0] < 224 or 239 < numbers[0]:
-        # ip address must be in the range from 224.0.0.0 to 239.255.255.255
-        return False
-    else:
-        return True  # OK
+SOCKADDR_IN_SIZE = 16  # sizeof(struct sockaddr_in)
+
+# Linux socket option for kernel receive timestamps, and also the type of the control message
+# that carries them. Its C equivalent is a struct cmsghdr followed by a struct timespec:
+# struct { size_t cmsg_len; int cmsg_level; int cmsg_type; long tv_sec; long tv_nsec; };
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+# Linux socket options that set a buffer size beyond the system maximum, for privileged processes.
+SO_SNDBUFFORCE = getattr(socket, "SO_SNDBUFFORCE", 32)
+SO_RCVBUFFORCE = getattr(socket, "SO_RCVBUFFORCE", 33)
+# Linux socket option that disables the UDP checksum on outgoing packets.
+SO_NO_CHECK = getattr(socket, "SO_NO_CHECK", 11)
+# Linux socket option that, when disabled, only delivers the multicast groups joined on this socket.
+IP_MULTICAST_ALL = getattr(socket, "IP_MULTICAST_ALL", 49)
+_CMSG_TIMESPEC_STRUCT = struct.Struct("@Niill")
+TIMESPEC_SIZE = struct.calcsize("@ll")
+
+
+def loadLibc():
+    # recvmmsg() and sendmmsg() are Linux specific. None means one packet per system call has to be used instead.
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.recvmmsg.argtypes = [
+            ctypes.c_int,
+            ctypes.POINTER(mmsghdr),
+            ctypes.c_uint,
+            ctypes.c_int,
+            ctypes.c_void_p,
+        ]
+        libc.recvmmsg.restype = ctypes.c_int
+        libc.sendmmsg.argtypes = [
+            ctypes.c_int,
+            ctypes.c_void_p,
+            ctypes.c_uint,
+            ctypes.c_int,
+        ]
+        libc.sendmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_LIBC = loadLibc()
+
+
+def ipAddressCheck(address):
+    # Returns whether the address is a valid IPv4 address and whether it is a multicast address,
+    # parsing it only once. inet_pton() only accepts the dotted quad of four decimal numbers,
+    # unlike inet_aton() which also takes shorthand, octal and hex forms and ignores trailing text.
+    try:
+        packed = socket.inet_pton(socket.AF_INET, address)
+    except (OSError, ValueError):
+        return (False, False)
+    # multicast addresses range from 224.0.0.0 to 239.255.255.255
+    return (True, 224 <= packed[0] <= 239)
 
 
 def multicastAddressCheck(address):
     if address == None:
         print("\nERROR: Missing multicast address.\n")
         return False
-    elif not ipAddressSanityCheck(address):
+    valid, multicast = ipAddressCheck(address)
+    if not valid:
         print("\nERROR: Provided multicast address is not a valid address.\n")
         return False
-    elif not ipAddressMulticastCheck(address):
+    elif not multicast:
         print("\nERROR: Provided multicast address does not support multicast.\n")
         return False
     else:
@@ -63,13 +141,28 @@ def networkInterfaceCheck(interface):
     if interface == None:
         print("\nERROR: Missing network interface address.\n")
         return False
-    elif not ipAddressSanityCheck(interface):
+    valid, multicast = ipAddressCheck(interface)
+    if not valid:
         print("\nERROR: Provided network interface is not a valid address.\n")
         return False
     else:
         return True
 
 
+def percentileList(text):
+    # Parses a comma separated list of percentiles, e.g. "100,99.99,99,90", for the argument parser.
+    try:
+        percentiles = [float(item) for item in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid percentile list: '{text}'")
+    for percentile in percentiles:
+        if not 0.0 < percentile <= 100.0:
+            raise argparse.ArgumentTypeError(
+                f"percentile {percentile} is not in the range (0, 100]"
+            )
+    return percentiles
+
+
 def UDPTESTER_CEILTO_MIN_PKTSIZE(size):
     if size < UDPTESTER_MIN_PKTSIZE:
         return UDPTESTER_MIN_PKTSIZE
@@ -79,10 +172,26 @@ def UDPTESTER_CEILTO_MIN_PKTSIZE(size):
 
 def progressBar(it, prefix="", size=60, file=sys.stdout):
     count = len(it)
+    # The bar strings for each possible number of hashes are built once.
+    bars = tuple(
+        "%s[%s%s]" % (prefix, "#" * x, "." * (size - x)) for x in range(size + 1)
+    )
+
+    # The bar is only redrawn when it grows, or otherwise at most 30 times per second to keep the
+    # counter moving, instead of a write and flush for every item.
+    redrawInterval = 1.0 / 30
+    lastX = -1
+    lastShow = 0.0
 
     def show(j):
+        nonlocal lastX, lastShow
         x = int(size * j / count)
-        file.write("%s[%s%s] %i/%i\r" % (prefix, "#" * x, "." * (size - x), j, count))
+        now = time.monotonic()
+        if x == lastX and now - lastShow < redrawInterval and j != count:
+            return
+        lastX = x
+        lastShow = now
+        file.write("%s %i/%i\r" % (bars[x], j, count))
         file.flush()
 
     show(0)
@@ -93,6 +202,64 @@ def progressBar(it, prefix="", size=60, file=sys.stdout):
     file.flush()
 
 
+def setSocketBufferSize(sock, option, forceOption, size):
+    # Requests a socket buffer size and returns the size the kernel actually applied. The kernel
+    # caps the request to a system maximum (net.core.rmem_max and wmem_max on Linux). On Linux a
+    # privileged process can go beyond that with the force variant of the option.
+    # Note that Linux reports twice the applied size, as it includes its bookkeeping overhead,
+    # so the reported size is halved there to compare it with the request.
+    sock.setsockopt(socket.SOL_SOCKET, option, size)
+    if not sys.platform.startswith("linux"):
+        return sock.getsockopt(socket.SOL_SOCKET, option)
+    if sock.getsockopt(socket.SOL_SOCKET, option) // 2 < size:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, forceOption, size)
+        except OSError:
+            pass  # Not permitted, the capped size remains
+    return sock.getsockopt(socket.SOL_SOCKET, option) // 2
+
+
+def interfaceInterruptCpus(interface):
+    # Returns the set of CPUs that have handled interrupts of the network device with the given
+    # interface address, read from /proc/interrupts on Linux. Returns an empty set when unknown.
+    try:
+        import fcntl
+
+        SIOCGIFADDR = 0x8915
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for index, name in socket.if_nameindex():
+                try:
+                    ifreq = fcntl.ioctl(
+                        probe.fileno(), SIOCGIFADDR, struct.pack("256s", name.encode())
+                    )
+                except OSError:
+                    continue  # Interface without an IPv4 address
+                if socket.inet_ntoa(ifreq[20:24]) == interface:
+                    break
+            else:
+                return set()
+        finally:
+            probe.close()
+        with open("/proc/interrupts") as f:
+            cpuCount = len(f.readline().split())
+            cpus = set()
+            # Device names are matched whole or up to a "-" separator, as used for queues like
+            # "eth1-TxRx-0", so that eth1 doesn't match eth10. Drivers may append ":" or ",".
+            for line in f:
+                fields = line.split()
+                devices = [field.rstrip(":,") for field in fields[cpuCount + 1 :]]
+                if any(
+                    device == name or device.startswith(name + "-")
+                    for device in devices
+                ):
+                    counts = fields[1 : cpuCount + 1]
+                    cpus.update(cpu for cpu, n in enumerate(counts) if n != "0")
+            return cpus
+    except (ImportError, OSError, AttributeError):
+        return set()
+
+
 class socketWaitset:
     def __init__(self, sock):
         self.sel = selectors.DefaultSelector()
@@ -105,7 +272,10 @@ class socketWaitset:
     # In Windows, both socket.recvfrom() and selectors.select() are blocking calls that
     # can't be interrupted by ctrl c. As a workaround, multiple mini waits are used
     # to have reasonable response time when pressing ctrl c to stop the application.
+    # Elsewhere ctrl c interrupts the select, so a single wait avoids needless wakeups.
     def wait(self, timeout):
+        if sys.platform != "win32":
+            return bool(self.sel.select(timeout))
         miniTimeout = 0.3
         max_attempts = math.ceil(timeout / miniTimeout)
         for attempt in range(0, max_attempts):
@@ -114,6 +284,170 @@ class socketWaitset:
         return False  # Timeout
 
 
+class udpBatchReceiver:
+    # Receives a batch of packets per call into one preallocated buffer, where packet i of the
+    # batch starts at offset i * slotSize. On Linux a whole batch is received with a single
+    # recvmmsg() system call, elsewhere a batch holds one packet received with recvfrom_into().
+    # The socket is expected to be non-blocking, receive() returns 0 when no data is available.
+    # On Linux the kernel also timestamps each packet on reception, see arrivalTime().
+    # The received length of the packet in each slot of the last batch is kept in lengths.
+    def __init__(self, sock, slotSize, batchSize):
+        self.sock = sock
+        self.slotSize = slotSize
+        self.batchSize = batchSize if _LIBC else 1
+        self.buffer = bytearray(self.slotSize * self.batchSize)
+        self.lengths = [0] * self.batchSize
+        self.count = 0
+        self.timestamps = False
+        if not _LIBC:
+            self.addresses = [None]
+            self.receive = self.receiveSingle
+            return
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            self.timestamps = True
+        except OSError:
+            pass
+
+        # Each message header points at its own slot in the buffer and its own source address.
+        self.fd = sock.fileno()
+        self.names = ctypes.create_string_buffer(SOCKADDR_IN_SIZE * self.batchSize)
+        self.iovecs = (iovec * self.batchSize)()
+        self.msgvec = (mmsghdr * self.batchSize)()
+        # and, for the receive timestamp, its own control buffer.
+        self.controlSize = socket.CMSG_SPACE(TIMESPEC_SIZE)
+        self.control = bytearray(self.controlSize * self.batchSize)
+        bufferAddress = ctypes.addressof(
+            (ctypes.c_char * len(self.buffer)).from_buffer(self.buffer)
+        )
+        controlAddress = ctypes.addressof(
+            (ctypes.c_char * len(self.control)).from_buffer(self.control)
+        )
+        self.headers = []
+        for i in range(self.batchSize):
+            self.iovecs[i].iov_base = bufferAddress + i * self.slotSize
+            self.iovecs[i].iov_len = self.slotSize
+            hdr = self.msgvec[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self.names) + i * SOCKADDR_IN_SIZE
+            hdr.msg_namelen = SOCKADDR_IN_SIZE
+            hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            hdr.msg_iovlen = 1
+            if self.timestamps:
+                hdr.msg_control = controlAddress + i * self.controlSize
+                hdr.msg_controllen = self.controlSize
+            self.headers.append(hdr)
+
+    def receive(self):
+        if self.timestamps:
+            # The kernel sets msg_controllen to the length it used, restore it for this call.
+            for hdr in self.headers[: self.count]:
+                hdr.msg_controllen = self.controlSize
+        count = _LIBC.recvmmsg(
+            self.fd, self.msgvec, self.batchSize, socket.MSG_DONTWAIT, None
+        )
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return 0
+            raise OSError(error, os.strerror(error))
+        self.lengths[:count] = [message.msg_len for message in self.msgvec[:count]]
+        self.count = count
+        return count
+
+    def receiveSingle(self):
+        try:
+            self.lengths[0], self.addresses[0] = self.sock.recvfrom_into(self.buffer)
+        except BlockingIOError:
+            return 0
+        return 1
+
+    # Returns the (host, port) source address of the packet in the given slot of the last batch.
+    def sourceAddress(self, slot):
+        if not _LIBC:
+            return self.addresses[slot]
+        name = self.names.raw[slot * SOCKADDR_IN_SIZE : (slot + 1) * SOCKADDR_IN_SIZE]
+        return (socket.inet_ntoa(name[4:8]), int.from_bytes(name[2:4], "big"))
+
+    # Returns the time in seconds since the epoch at which the packet in the given slot of the
+    # last batch was received. That is the kernel's receive timestamp when available, so the time
+    # the packet spent queued in the socket buffer is not counted, else it is the current time.
+    def arrivalTime(self, slot):
+        if self.timestamps:
+            offset = slot * self.controlSize
+            message = _CMSG_TIMESPEC_STRUCT.unpack_from(self.control, offset)
+            (length, level, kind, seconds, nanoseconds) = message
+            if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                return seconds + nanoseconds * 1e-9
+        return time.time()
+
+
+class udpBatchSender:
+    # Collects packets in slots of one preallocated buffer, where packet i of the batch starts at
+    # offset i * slotSize, and sends them with flush(). On Linux all collected packets are sent with
+    # a single sendmmsg() system call, elsewhere each packet is sent with send(). The socket is
+    # expected to be connected to the destination.
+    def __init__(self, sock, slotSize, batchSize):
+        self.sock = sock
+        self.slotSize = slotSize
+        self.batchSize = batchSize
+        self.buffer = bytearray(self.slotSize * self.batchSize)
+        self.view = memoryview(self.buffer)
+        self.sizes = [0] * self.batchSize
+        self.count = 0
+        if not _LIBC:
+            self.flush = self.flushSingle
+            return
+
+        # Each message header points at its own slot in the buffer. As the socket is connected,
+        # no destination address is needed.
+        self.fd = sock.fileno()
+        self.iovecs = (iovec * self.batchSize)()
+        self.msgvec = (mmsghdr * self.batchSize)()
+        bufferAddress = ctypes.addressof(
+            (ctypes.c_char * len(self.buffer)).from_buffer(self.buffer)
+        )
+        for i in range(self.batchSize):
+            self.iovecs[i].iov_base = bufferAddress + i * self.slotSize
+            hdr = self.msgvec[i].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            hdr.msg_iovlen = 1
+
+    # Adds a packet of the given size, which starts with the test header, to the batch.
+    # A full batch is sent first.
+    def add(self, msgIndex, packetIndex, timestamp, size):
+        if self.count == self.batchSize:
+            self.flush()
+        offset = self.count * self.slotSize
+        _HDR_STRUCT.pack_into(self.buffer, offset, msgIndex, packetIndex, timestamp)
+        self.sizes[self.count] = size
+        self.count += 1
+
+    def flush(self):
+        for i in range(self.count):
+            self.iovecs[i].iov_len = self.sizes[i]
+        sent = 0
+        while sent < self.count:
+            result = _LIBC.sendmmsg(
+                self.fd,
+                ctypes.addressof(self.msgvec) + sent * ctypes.sizeof(mmsghdr),
+                self.count - sent,
+                0,
+            )
+            if result < 0:
+                error = ctypes.get_errno()
+                if error == errno.EINTR:
+                    continue
+                raise OSError(error, os.strerror(error))
+            sent += result
+        self.count = 0
+
+    def flushSingle(self):
+        for i in range(self.count):
+            offset = i * self.slotSize
+            self.sock.send(self.view[offset : offset + self.sizes[i]])
+        self.count = 0
+
+
 class udpMetricsReportItem:
     def __init__(
         self,
@@ -134,8 +468,10 @@ class udpMetricsReportItem:
         self.deviation: float = deviation or 0
 
     def __str__(self):
+        # One decimal, or more when the percentile needs them, such as 99.99.
+        decimals = max(1, len(f"{self.percentile:g}".partition(".")[2]))
         return (
-            f"{self.percentile:5.1f} % : cnt= {self.valueCount}/{self.totalValueCount},"
+            f"{self.percentile:5.{decimals}f} % : cnt= {self.valueCount}/{self.totalValueCount},"
             f" latency [usec]: min= {self.minimum:.0f},"
             f" avg= {self.average:.0f}, max= {self.maximum:.0f}, deviation= {self.deviation:.2f}"
         )
@@ -144,33 +480,51 @@ class udpMetricsReportItem:
 class udpMetrics:
     def __init__(self, max_number_of_values, values=None):
         self.max_number_of_values: int = max_number_of_values
-        self.values: list = values or []
+        # The values are stored as C doubles in one contiguous array instead of as float objects.
+        # The array is allocated for the maximum number of values up front, so it is never resized
+        # while receiving, and only its first count values are in use.
+        values = values or []
+        self.count: int = len(values)
+        self.values: array.array = array.array("d", [0.0]) * max(
+            max_number_of_values, self.count
+        )
+        self.values[: self.count] = array.array("d", values)
 
     def append(self, value):
-        if len(self.values) < self.max_number_of_values:
-            self.values.append(value)
+        if self.count < self.max_number_of_values:
+            self.values[self.count] = value
+            self.count += 1
 
     def report(self, percentile):
         # ensure at least one value
-        count = int(len(self.values) * percentile / 100.0)
+        count = int(self.count * percentile / 100.0)
 
         if count < 1:
             return udpMetricsReportItem()
 
         values = self.values[:count]
+        average = math.fsum(values) / count
+
+        # Sample standard deviation in one pass over the values, reusing the average above.
+        if count > 1:
+            deviation = math.sqrt(
+                math.fsum([(value - average) ** 2 for value in values]) / (count - 1)
+            )
+        else:
+            deviation = math.nan
 
         return udpMetricsReportItem(
             percentile=percentile,
-            valueCount=len(values),
-            totalValueCount=len(self.values),
+            valueCount=count,
+            totalValueCount=self.count,
             minimum=values[0],
-            average=statistics.mean(values),
+            average=average,
             maximum=values[-1],
-            deviation=statistics.stdev(values) if len(values) > 1 else math.nan,
+            deviation=deviation,
         )
 
     def reports(self, percentiles):
-        self.values.sort()
+        self.values[: self.count] = array.array("d", sorted(self.values[: self.count]))
         return [self.report(percentile) for percentile in percentiles]
 
 
@@ -183,6 +537,7 @@ def transmitter(parser):
     DEFAULT_PACKETSIZE = 1300
     DEFAULT_LOSSINESS = 0
     DEFAULT_MULTI_TTL = 64
+    DEFAULT_SNDBUFSIZE = 12 * 1024 * 1024
 
     messageSize = DEFAULT_MSGSIZE
     totNofMsgs = DEFAULT_TOTNOFMSGS
@@ -191,6 +546,7 @@ def transmitter(parser):
     packetSize = DEFAULT_PACKETSIZE
     lossiness = DEFAULT_LOSSINESS
     multiTTL = DEFAULT_MULTI_TTL
+    sndBufSize = DEFAULT_SNDBUFSIZE
 
     args, args_remaining = parser.parse_known_args()
 
@@ -221,6 +577,9 @@ def transmitter(parser):
         frequency = args.frequency
     if args.lossiness != None:
         lossiness = args.lossiness
+    if args.sendbuffer != None:
+        sndBufSize = args.sendbuffer
+    noChecksum = args.nochecksum
 
     print(
         f"""
@@ -231,12 +590,28 @@ def transmitter(parser):
     messagesize is set to   {messageSize} bytes
     packetsize is set to    {packetSize} bytes
     frequency is set to     {frequency} Hz
-    lossiness is set to     {lossiness}%"""
+    lossiness is set to     {lossiness}%
+    sendbuffer is set to    {sndBufSize} bytes
+    checksum is set to      {"off" if noChecksum else "on"}"""
     )
 
     # Set the socket options for multicast transmitter
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    appliedSndBufSize = setSocketBufferSize(
+        sock, socket.SO_SNDBUF, SO_SNDBUFFORCE, sndBufSize
+    )
+    print(f"    sendbuffer is effectively {appliedSndBufSize} bytes")
+    if appliedSndBufSize < sndBufSize:
+        print(
+            f"    WARNING: sendbuffer is smaller than requested, on Linux raise the limit with: sysctl -w net.core.wmem_max={sndBufSize}"
+        )
+    if noChecksum:
+        # The receiver's message and packet index checks still catch loss and reordering.
+        if sys.platform.startswith("linux"):
+            sock.setsockopt(socket.SOL_SOCKET, SO_NO_CHECK, 1)
+        else:
+            print("    WARNING: --no-checksum is only supported on Linux, ignoring it")
     ttl = struct.pack("<b", multiTTL)
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
     try:
@@ -250,34 +625,62 @@ def transmitter(parser):
         parser.print_help()
         sys.exit(1)
     multicast_group = (address, portNr)
+    # Connecting sets the destination once, so packets are sent without passing the address each time.
+    sock.connect(multicast_group)
 
     sleepTime = 1.0 / frequency
-    progress = progressBar(totNofMsgs)
-    print(f"  Sending {totNofMsgs} messages now...")
-    for i in progressBar(range(0, totNofMsgs), "  Progress: ", 20):
-        msgIndex = i
-        packetIndex = 0
-        timestamp = time.time()
-        remainingSize = messageSize
-
-        # Loop until the full msgSize has been sent.
-        while remainingSize > 0:
-            if remainingSize > packetSize:
-                bufSize = UDPTESTER_CEILTO_MIN_PKTSIZE(packetSize)
-            else:
-                bufSize = UDPTESTER_CEILTO_MIN_PKTSIZE(remainingSize)
-            # In case of lossiness, I randomly skip sending the packet.
-            if not (lossiness and (random.randint(0, 100) < lossiness)):
-                buffer = ctypes.create_string_buffer(bufSize)
-                struct.pack_into(
-                    UDPTESTER_HDRFORMAT, buffer, 0, msgIndex, packetIndex, timestamp
-                )
 
-                # The buffer contains my data in C struct format, and is sent using the socket.
-                sock.sendto(buffer, multicast_group)
-            remainingSize -= bufSize
-            packetIndex += 1
-        time.sleep(sleepTime)
+    # The sizes of the packets that each message is split into are the same for all messages.
+    # The full messageSize is covered, each packet is at least large enough for the header.
+    fragments = []
+    remainingSize = messageSize
+    while remainingSize > 0:
+        fragments.append(UDPTESTER_CEILTO_MIN_PKTSIZE(min(remainingSize, packetSize)))
+        remainingSize -= fragments[-1]
+    fragments = tuple(fragments)
+
+    # The packets of a message are collected in a reused buffer and sent together. Only the
+    # header is rewritten per packet, a shorter packet is sent from the start of its slot.
+    sendBatch = udpBatchSender(
+        sock,
+        max(packetSize, UDPTESTER_MIN_PKTSIZE),
+        max(1, min(len(fragments), UDPTESTER_SEND_BATCHSIZE)),
+    )
+    # Chance that a packet is skipped, drawn with random.random() which is cheaper than randint().
+    dropChance = lossiness / 100.0
+    randomFraction = random.random
+    # Bind the per-packet and per-message calls to locals, as they are looked up in every iteration.
+    addPacket = sendBatch.add
+    flushPackets = sendBatch.flush
+    wallClock = time.time
+    sleep = time.sleep
+    clock = time.perf_counter
+
+    print(f"  Sending {totNofMsgs} messages now...")
+    sentMsgs = 0
+    # Messages are paced against a deadline that advances by sleepTime per message, so the time
+    # spent sending and any oversleep are not added to the interval and the rate doesn't drift.
+    # A transmitter that falls more than one interval behind restarts from the current time
+    # instead of sending a burst to catch up.
+    deadline = clock()
+    try:
+        for msgIndex in progressBar(range(0, totNofMsgs), "  Progress: ", 20):
+            timestamp = wallClock()
+            for packetIndex, bufSize in enumerate(fragments):
+                # In case of lossiness, I randomly skip sending the packet.
+                if not (dropChance and randomFraction() < dropChance):
+                    # The buffer contains my data in C struct format, and is sent using the socket.
+                    addPacket(msgIndex, packetIndex, timestamp, bufSize)
+            flushPackets()
+            sentMsgs += 1
+            deadline += sleepTime
+            delay = deadline - clock()
+            if delay > 0:
+                sleep(delay)
+            elif delay < -sleepTime:
+                deadline = clock()
+    except KeyboardInterrupt:
+        print(f"\n  Stopped after sending {sentMsgs} of {totNofMsgs} messages")
     sock.close()
 
 
@@ -288,7 +691,8 @@ def receiver(parser):
     DEFAULT_EXPECTEDCOUNT = 1000
     DEFAULT_REPORTINTERVAL = 100
     DEFAULT_PACKETSIZE = 1300
-    DEFAULT_RCVBUFSIZE = 120000
+    DEFAULT_RCVBUFSIZE = 12 * 1024 * 1024
+    DEFAULT_PERCENTILES = [100.0, 99.9, 99.0, 90.0]
 
     RECEIVE_TIMEOUT_SEC = 10
     RECEIVE_TIMEOUT_SEC_INITIAL = 100
@@ -299,6 +703,7 @@ def receiver(parser):
     reportInterval = DEFAULT_REPORTINTERVAL
     packetSize = DEFAULT_PACKETSIZE
     rcvBufSize = DEFAULT_RCVBUFSIZE
+    percentiles = DEFAULT_PERCENTILES
 
     args, args_remaining = parser.parse_known_args()
 
@@ -328,6 +733,10 @@ def receiver(parser):
         reportInterval = args.reportinterval
     if args.receivebuffer != None:
         rcvBufSize = args.receivebuffer
+    if args.percentiles != None:
+        percentiles = args.percentiles
+    cpu = args.cpu
+    realtime = args.realtime
 
     print(
         f"""
@@ -338,14 +747,32 @@ def receiver(parser):
     messagesize is set to    {messageSize} bytes
     packetsize is set to     {packetSize} bytes
     receivebuffer is set to  {rcvBufSize} bytes
-    reportInterval is set to {reportInterval}"""
+    reportInterval is set to {reportInterval}
+    percentiles are set to   {", ".join(f"{p:g}" for p in percentiles)}
+    cpu is set to            {"any" if cpu is None else cpu}
+    realtime is set to       {"on" if realtime else "off"}"""
     )
 
     # Set the socket options for multicast receiver
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvBufSize)
+    appliedRcvBufSize = setSocketBufferSize(
+        sock, socket.SO_RCVBUF, SO_RCVBUFFORCE, rcvBufSize
+    )
+    print(f"    receivebuffer is effectively {appliedRcvBufSize} bytes")
+    if appliedRcvBufSize < rcvBufSize:
+        print(
+            f"    WARNING: receivebuffer is smaller than requested, on Linux raise the limit with: sysctl -w net.core.rmem_max={rcvBufSize}"
+        )
+    # Allow more than one receiver on this host to bind the port, each receives all packets.
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     sock.bind(("", portNr))
+    # Linux otherwise delivers packets of any group joined on this host to the port, for example
+    # by another receiver testing a different group, which would be counted as unexpected packets.
+    if sys.platform.startswith("linux"):
+        sock.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
     multicast_group = socket.inet_aton(joinAddressString)
     networkInterface = socket.inet_aton(interface)
     mreq = struct.pack("4s4s", multicast_group, networkInterface)
@@ -360,12 +787,53 @@ def receiver(parser):
     sock.setblocking(False)
     waitset = socketWaitset(sock)
 
+    # Running on the CPU that handles the network device's interrupts avoids waking up on another
+    # core, and real-time scheduling keeps other processes from delaying the receiver.
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except AttributeError:
+            print("    WARNING: --cpu is not supported on this platform, ignoring it")
+            cpu = None
+        except (OSError, ValueError, OverflowError):
+            print(
+                f"    WARNING: cpu {cpu} is not available to this process, ignoring it"
+            )
+            cpu = None
+    if cpu is not None:
+        irqCpus = interfaceInterruptCpus(interface)
+        if irqCpus and cpu not in irqCpus:
+            print(
+                f"    WARNING: cpu {cpu} does not handle interrupts of interface {interface}, these are handled by cpu {sorted(irqCpus)}"
+            )
+    if realtime:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(50))
+        except AttributeError:
+            print(
+                "    WARNING: --realtime is not supported on this platform, ignoring it"
+            )
+        except PermissionError:
+            print("    WARNING: --realtime requires privileges, ignoring it")
+
+    # Packets are received in batches into one preallocated buffer, instead of a new bytes object
+    # and a system call per packet.
+    # Small packets are received in batches of up to UDPTESTER_RECV_BATCHSIZE, large packets in
+    # smaller batches so the buffer stays within UDPTESTER_RECV_BATCHBYTES.
+    slotSize = max(packetSize, UDPTESTER_HDRSIZE)
+    receiveBatch = udpBatchReceiver(
+        sock,
+        slotSize,
+        max(1, min(UDPTESTER_RECV_BATCHSIZE, UDPTESTER_RECV_BATCHBYTES // slotSize)),
+    )
+    rxbuf = receiveBatch.buffer
+
     # Metrics about the received data
     metrics = udpMetrics(reportInterval)
-    percentiles = [100.0, 99.9, 99.0, 90.0]
     expectedMsgIndex = 0
     expectedPacketIndex = 0
-    packetsPerMessage = math.ceil(messageSize / packetSize)
+    # Integer ceiling division, exact for any size unlike rounding up a float quotient.
+    packetsPerMessage = -(-messageSize // packetSize)
     reportCount = reportInterval * packetsPerMessage
     nextAnalyseIndex = reportInterval
     totalPacketsExpected = packetsPerMessage * expectedCount
@@ -373,79 +841,136 @@ def receiver(parser):
     totalMsgs = 0
     subTotalMsgs = 0
     msgIncomplete = 0
-    tallysheet = [[0] * packetsPerMessage for j in range(0, expectedCount)]
-    duplicatePackets = 0
+    # Packet counts as one flat array of C unsigned ints, indexed by msgIndex * packetsPerMessage + packetIndex.
+    tallysheet = array.array("I", [0]) * (expectedCount * packetsPerMessage)
     receiveTimeOut = RECEIVE_TIMEOUT_SEC_INITIAL
 
-    print(f"  Waiting for {expectedCount} messages now...")
-    while expectedMsgIndex < expectedCount:
-        # The buffer contains transmitter's data in C struct format, and is received using the socket.
-        if not waitset.wait(receiveTimeOut):
-            print(
-                f"WARNING: Timed out after {receiveTimeOut} seconds whilst waiting for packets."
-            )
-            break
-        bytedata, sourceAddress = sock.recvfrom(packetSize)
-        (msgIndex, packetIndex, timestamp) = struct.unpack(
-            UDPTESTER_HDRFORMAT, bytedata[:UDPTESTER_HDRSIZE]
-        )
-
-        # Check and count received packets.
-        if (0 <= msgIndex and msgIndex < expectedCount) and (
-            0 <= packetIndex and packetIndex < packetsPerMessage
-        ):
-            tallysheet[msgIndex][packetIndex] += 1
-        if tallysheet[msgIndex][packetIndex] > 1:
-            duplicatePackets += 1
-        if (msgIndex != expectedMsgIndex) or (packetIndex != expectedPacketIndex):
-            print(
-                f"Expected msgIndex {expectedMsgIndex} and packetIndex {expectedPacketIndex}, "
-                f"received msgIndex {msgIndex} and packetIndex {packetIndex} with count {tallysheet[ msgIndex ][ packetIndex ]}"
-            )
-            expectedMsgIndex = msgIndex
-            msgIncomplete = packetIndex != 0
-        if packetIndex == (packetsPerMessage - 1):
-            expectedMsgIndex += 1
-            expectedPacketIndex = 0
-            if msgIncomplete:
-                msgIncomplete = 0
-            else:
-                totalMsgs += 1
-                subTotalMsgs += 1
-                metrics.append(
-                    (time.time() - timestamp) * 1e6
-                )  # Latency in microseconds
-        else:
-            expectedPacketIndex = packetIndex + 1
-        totalPackets += 1
-        reportCount -= 1
-
-        # Report metrics
-        if reportCount == 0:
-            print(
-                f"received {totalPackets} packets from {sourceAddress[0]}, expecting {totalPacketsExpected} in total"
-            )
-            reportCount = reportInterval * packetsPerMessage
+    # Bind the functions used per packet to locals, which are cheaper to look up in the loop.
+    arrivalTime = receiveBatch.arrivalTime
+    waitForData = waitset.wait
+    receive = receiveBatch.receive
+    packetLengths = receiveBatch.lengths
+    unpackHeader = _HDR_STRUCT.unpack_from
+    appendLatency = metrics.append
 
-        if expectedMsgIndex >= nextAnalyseIndex:
-            print(f"Expecting message with index {expectedMsgIndex}:")
-            print(f"    {totalMsgs:5d} complete messages so far.")
-            print(f"    {subTotalMsgs:5d} complete messages since the last report.")
+    # Mismatch messages are collected and printed together when the socket has no packets queued
+    # or before a report, instead of writing to stdout between the receive calls of a burst.
+    pendingMessages = []
+    logMessage = pendingMessages.append
 
-            for reportItem in metrics.reports(percentiles):
-                print(f"    {reportItem}")
+    def printPendingMessages():
+        if pendingMessages:
+            print("\n".join(pendingMessages))
+            pendingMessages.clear()
 
-            metrics = udpMetrics(reportInterval)
-            nextAnalyseIndex = (
-                expectedMsgIndex + reportInterval - expectedMsgIndex % reportInterval
-            )
-            subTotalMsgs = 0
+    print(f"  Waiting for {expectedCount} messages now...")
+    interrupted = False
+    try:
+        while expectedMsgIndex < expectedCount:
+            # The buffer contains transmitter's data in C struct format, and is received using the socket.
+            # Waiting is only needed when no packets are queued, so a busy socket is drained without
+            # a select() call per batch.
+            count = receive()
+            if count == 0:
+                printPendingMessages()
+                if not waitForData(receiveTimeOut):
+                    print(
+                        f"WARNING: Timed out after {receiveTimeOut} seconds whilst waiting for packets."
+                    )
+                    break
+                continue
+            for slot in range(count):
+                # The batch may hold packets beyond the last expected message, those are not counted.
+                if expectedMsgIndex >= expectedCount:
+                    break
+                # A packet shorter than the header would be read together with an earlier packet's
+                # leftover bytes in its slot, so it is reported and not counted.
+                if packetLengths[slot] < UDPTESTER_HDRSIZE:
+                    logMessage(
+                        f"Ignored packet of {packetLengths[slot]} bytes, shorter than the {UDPTESTER_HDRSIZE} bytes header"
+                    )
+                    continue
+                (msgIndex, packetIndex, timestamp) = unpackHeader(
+                    rxbuf, slot * slotSize
+                )
 
-        if receiveTimeOut != RECEIVE_TIMEOUT_SEC:
-            receiveTimeOut = RECEIVE_TIMEOUT_SEC
-    # end while
+                # Check and count received packets. Packets with indices outside of the tallysheet are not counted.
+                packetCount = 0
+                if (
+                    0 <= msgIndex < expectedCount
+                    and 0 <= packetIndex < packetsPerMessage
+                ):
+                    tallyIndex = msgIndex * packetsPerMessage + packetIndex
+                    packetCount = tallysheet[tallyIndex] + 1
+                    tallysheet[tallyIndex] = packetCount
+                if (msgIndex != expectedMsgIndex) or (
+                    packetIndex != expectedPacketIndex
+                ):
+                    logMessage(
+                        f"Expected msgIndex {expectedMsgIndex} and packetIndex {expectedPacketIndex}, "
+                        f"received msgIndex {msgIndex} and packetIndex {packetIndex} with count {packetCount}"
+                    )
+                    expectedMsgIndex = msgIndex
+                    msgIncomplete = packetIndex != 0
+                if packetIndex == (packetsPerMessage - 1):
+                    expectedMsgIndex += 1
+                    expectedPacketIndex = 0
+                    if msgIncomplete:
+                        msgIncomplete = 0
+                    else:
+                        totalMsgs += 1
+                        subTotalMsgs += 1
+                        # Latency in microseconds
+                        appendLatency((arrivalTime(slot) - timestamp) * 1e6)
+                else:
+                    expectedPacketIndex = packetIndex + 1
+                totalPackets += 1
+                reportCount -= 1
+
+                # Report metrics
+                if reportCount == 0:
+                    printPendingMessages()
+                    sourceAddress = receiveBatch.sourceAddress(slot)
+                    print(
+                        f"received {totalPackets} packets from {sourceAddress[0]}, expecting {totalPacketsExpected} in total"
+                    )
+                    reportCount = reportInterval * packetsPerMessage
+
+                if expectedMsgIndex >= nextAnalyseIndex:
+                    printPendingMessages()
+                    print(f"Expecting message with index {expectedMsgIndex}:")
+                    print(f"    {totalMsgs:5d} complete messages so far.")
+                    print(
+                        f"    {subTotalMsgs:5d} complete messages since the last report."
+                    )
+
+                    for reportItem in metrics.reports(percentiles):
+                        print(f"    {reportItem}")
+
+                    metrics = udpMetrics(reportInterval)
+                    appendLatency = metrics.append
+                    nextAnalyseIndex = (
+                        expectedMsgIndex
+                        + reportInterval
+                        - expectedMsgIndex % reportInterval
+                    )
+                    subTotalMsgs = 0
+
+            if receiveTimeOut != RECEIVE_TIMEOUT_SEC:
+                receiveTimeOut = RECEIVE_TIMEOUT_SEC
+        # end while
+    except KeyboardInterrupt:
+        interrupted = True
+    printPendingMessages()
     waitset.close()
     sock.close()
+    if interrupted and subTotalMsgs > 0:
+        # Report the messages since the last report, which are otherwise not shown for a stopped run.
+        print(f"Stopped whilst expecting message with index {expectedMsgIndex}:")
+        print(f"    {totalMsgs:5d} complete messages so far.")
+        print(f"    {subTotalMsgs:5d} complete messages since the last report.")
+        for reportItem in metrics.reports(percentiles):
+            print(f"    {reportItem}")
     print("Done")
     lost = 100.0 * float((totalPacketsExpected - totalPackets) / totalPacketsExpected)
     print(
@@ -455,6 +980,8 @@ def receiver(parser):
     print(
         f"Received {totalMsgs} complete messages out of {expectedCount}, lost {lost:.1f}%"
     )
+    # Every receipt of a packet beyond its first is a duplicate, counted once at the end instead of per packet.
+    duplicatePackets = sum(tallysheet) - (len(tallysheet) - tallysheet.count(0))
     print(f"Received {duplicatePackets} duplicate packets")
 
 
@@ -544,6 +1071,18 @@ Example:
         help="transmitter option: Randomly skip sending a packet, chance in unit %%.",
         type=int,
     )
+    parser_transmitter.add_argument(
+        "-b",
+        "--sendbuffer",
+        help="transmitter option: sendbuffer size in bytes.",
+        type=int,
+    )
+    parser_transmitter.add_argument(
+        "--no-checksum",
+        dest="nochecksum",
+        help="transmitter option: Send packets without UDP checksum (Linux only).",
+        action="store_true",
+    )
 
     # receiver specific args
     epilogStringReceiver = """
@@ -552,7 +1091,8 @@ Example:
     """
     description_string = """
 Receive multicast messages. If I receive all messages from the transmitter, the network has passed the test.
-The results will also show latency values in microseconds, calculated as current_time - source_timestamp. These values
+The results will also show latency values in microseconds, calculated as receive_time - source_timestamp. On Linux the
+receive_time is the kernel's timestamp of the packet's arrival, elsewhere it is the time the packet is processed. These values
 are not reliable when transmitter's and receiver's clocks are not precisely synchronized, and may be negative when the 
 receiver's clock is trailing the transmitter's clock.
     """
@@ -576,14 +1116,32 @@ receiver's clock is trailing the transmitter's clock.
         help="receiver option: Number of messages per report.",
         type=int,
     )
+    parser_receiver.add_argument(
+        "-C",
+        "--cpu",
+        help="receiver option: Run the receiver on this CPU, preferably the one handling the interface's interrupts.",
+        type=int,
+    )
+    parser_receiver.add_argument(
+        "--realtime",
+        help="receiver option: Run the receiver with real-time (SCHED_FIFO) priority (Linux only).",
+        action="store_true",
+    )
+    parser_receiver.add_argument(
+        "--percentiles",
+        help="receiver option: Comma separated latency percentiles to report, default 100,99.9,99,90.",
+        type=percentileList,
+    )
 
     return (parser, parser_receiver, parser_transmitter)
 
 
 def activate_signal_handler():
+    # Ctrl c interrupts the transmitter or receiver loop, which then closes its socket and prints
+    # the results so far.
     def signalHandler(signum, frame):
         print(" Ctrl c was pressed. Exiting...")
-        sys.exit(0)
+        raise KeyboardInterrupt
 
     signal.signal(signal.SIGINT, signalHandler)
 